@@ -0,0 +1,65 @@
+# 收件人存储内存基准：dict 列表 vs RecipientStore，姓名按真实名单分布生成（绝大多数行互不相同）
+# 用法: python bench_recipients.py [行数，默认 1000000]
+import random
+import sys
+import time
+import tracemalloc
+
+from recipient_store import RecipientStore
+
+SURNAMES = ["Wang", "Li", "Zhang", "Liu", "Chen", "Yang", "Huang", "Zhao", "Wu", "Zhou",
+            "Smith", "Johnson", "Brown", "Garcia", "Miller", "Davis", "Martin", "Lopez"]
+SYLLABLES = ["an", "bo", "chen", "da", "fei", "hao", "jia", "kai", "lin", "ming", "na", "qing",
+             "rui", "shu", "ting", "wei", "xin", "yu", "zhi", "el", "ri", "ka", "to", "sa"]
+DOMAINS = ["gmail.com", "qq.com", "163.com", "outlook.com", "yahoo.com", "hotmail.com", "126.com"]
+
+
+def make_rows(n, seed=1):
+    rnd = random.Random(seed)
+    for i in range(n):
+        first = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 3))).capitalize()
+        last = rnd.choice(SURNAMES)
+        local = f"{first.lower()}.{last.lower()}{rnd.randint(0, 9999)}"
+        # 约 5% 的行是企业域名，其余落在几个大邮箱服务商
+        domain = f"corp{rnd.randint(0, 5000)}.com" if rnd.random() < 0.05 else rnd.choice(DOMAINS)
+        yield {"email": f"{local}@{domain}", "name": first, "real_name": f"{first} {last}"}
+
+
+def measure(label, build):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<16} 当前 {current/1024/1024:8.1f} MiB  峰值 {peak/1024/1024:8.1f} MiB  构建 {elapsed:6.2f}s")
+    return obj, current
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"行数: {n}")
+    rows, dict_bytes = measure("dict 列表", lambda: list(make_rows(n)))
+    print(f"不同 name: {len({r['name'] for r in rows})}, 不同 real_name: {len({r['real_name'] for r in rows})}")
+    del rows
+    store, store_bytes = measure("RecipientStore", lambda: RecipientStore(make_rows(n)))
+    print(f"每行: dict {dict_bytes/n:.1f} B, store {store_bytes/n:.1f} B, 节省 {1 - store_bytes/dict_bytes:.0%}")
+
+    # 常用操作耗时
+    t0 = time.perf_counter()
+    for _ in range(10000):
+        store.popleft()
+    print(f"popleft x10000: {time.perf_counter()-t0:.3f}s")
+    t0 = time.perf_counter()
+    store.copy()
+    print(f"copy(快照): {(time.perf_counter()-t0)*1000:.2f}ms")
+    t0 = time.perf_counter()
+    store.page(n // 2, 100)
+    print(f"page(中间, 100): {(time.perf_counter()-t0)*1000:.2f}ms")
+    t0 = time.perf_counter()
+    removed = store.remove_if(lambda e: e.endswith("@qq.com"))
+    print(f"remove_if 删除 {removed} 条: {time.perf_counter()-t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
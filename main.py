@@ -4,23 +4,230 @@ import smtplib
 import time
 import datetime
 import json
+import math
+import struct
+import hashlib
+import gzip
+import itertools
+import heapq
+import codecs
+import uuid
+import random
+import sys
+import shutil
+import tempfile
+import fnmatch
 import requests
 from flask import Flask, request, jsonify, render_template_string, send_file, Response
 from email.mime.text import MIMEText
 from email.header import Header
 from io import StringIO, BytesIO
-from threading import Thread, Lock
+from threading import Thread, Lock, local, get_ident
+from contextlib import contextmanager
 from queue import Queue
+from array import array
+from collections import deque, Counter
+from zoneinfo import ZoneInfo
+from recipient_store import RecipientStore
 import atexit
 
 
 app = Flask(__name__)
 
 # ================== 配置 ==================
-DAILY_LIMIT = 450
-RECIPIENTS_FILE = "recipients.json"
-LOG_FILE_JSON = "send_log.json"
-USAGE_FILE_JSON = "account_usage.json"
+# 投递后端：smtp 为真实发送；simulated 为模拟投递（不建连接），用于容量规划演练
+DELIVERY_BACKEND = os.getenv("DELIVERY_BACKEND", "smtp")
+SIM_SPEED = float(os.getenv("SIM_SPEED", 1))             # 模拟时虚拟时间相对真实时间的倍速
+SIM_PROFILE = json.loads(os.getenv("SIM_PROFILE", "{}"))  # 见 SimulatedBackend.DEFAULT_PROFILE
+# 模拟演练的全部数据文件都放在 SIM_DATA_DIR，绝不读写正式的收件人、已发送索引、配额和日志
+SIM_DATA_DIR = os.getenv("SIM_DATA_DIR", "")
+DATA_DIR = ""
+if DELIVERY_BACKEND == "simulated":
+    if not SIM_DATA_DIR or os.path.abspath(SIM_DATA_DIR) == os.path.abspath("."):
+        sys.exit("DELIVERY_BACKEND=simulated 时必须把 SIM_DATA_DIR 设为独立于正式数据的目录")
+    os.makedirs(SIM_DATA_DIR, exist_ok=True)
+    DATA_DIR = SIM_DATA_DIR
+
+DAILY_LIMIT = int(os.getenv("DAILY_LIMIT", 450))   # 每个账号每个配额窗口的发送上限
+RECIPIENTS_FILE = os.path.join(DATA_DIR, "recipients.json")
+LOG_FILE_JSON = os.path.join(DATA_DIR, "send_log.json")   # 旧版整文件日志，启动时一次性迁移
+LOG_DIR = os.path.join(DATA_DIR, "send_logs")
+LOG_ROTATE = os.getenv("LOG_ROTATE", "daily")   # daily | hourly
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1") != "0"
+LOG_RETENTION_HOURS = int(os.getenv("LOG_RETENTION_HOURS", 24*7))
+USAGE_FILE_JSON = os.path.join(DATA_DIR, "account_usage.json")
+QUOTA_MODE = os.getenv("QUOTA_MODE", "calendar")     # calendar: 按自然日重置 | rolling: 滚动 24 小时
+QUOTA_TZ = os.getenv("QUOTA_TZ", "Asia/Shanghai")    # 自然日按该时区划分
+QUOTA_BUCKET_SECONDS = 300   # 用量按 5 分钟分桶计数
+QUOTA_FLUSH_SECONDS = 5      # 用量文件最多每 5 秒落盘一次（退出时强制落盘）
+JOBS_FILE = os.path.join(DATA_DIR, "jobs.json")
+IDEMPOTENCY_FILE = os.path.join(DATA_DIR, "idempotency.json")
+IDEMPOTENCY_TTL_HOURS = 24
+ENQUEUE_CHUNK = 1000   # 批量入队每攒够这么多条加一次锁写入队列
+SENT_BLOOM_FILE = os.path.join(DATA_DIR, "sent_bloom.bin")
+SUPPRESSION_FILE = os.path.join(DATA_DIR, "suppression.txt")
+SENT_BLOOM_CAPACITY = 1_000_000   # 单个 Bloom 分片容量，写满后自动追加新分片
+SENT_BLOOM_ERROR = 0.0001         # 单分片误判率
+
+# 按收件域名调度：DOMAIN_LIMITS 形如 {"gmail.com": {"concurrency": 1, "per_minute": 20}}
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 1))            # 并发发送线程数
+DOMAIN_DEFAULT_LIMIT = {"concurrency": 2, "per_minute": 0}  # per_minute=0 表示不限速
+DOMAIN_LIMITS = json.loads(os.getenv("DOMAIN_LIMITS", "{}"))
+DISPATCH_LOOKAHEAD = 1000   # 调度器从队列取出暂存的最大条数（域名队列与积压区合计）
+DOMAIN_STAGE_CAP = 200      # 单个域名最多预取条数，超出的进入该域名积压区，避免单一域名占满预取
+DEFER_BACKOFF_BASE = 30     # 收到 4xx 延迟后该域名退避秒数，连续延迟翻倍
+DEFER_BACKOFF_MAX = 900
+
+if DATA_DIR:
+    # 模拟目录首次使用时复制一份正式的待发名单、退订名单和已发送索引作为起点（只读正式文件）
+    for name in ("recipients.json", "suppression.txt", "sent_bloom.bin"):
+        if os.path.exists(name) and not os.path.exists(os.path.join(DATA_DIR, name)):
+            shutil.copyfile(name, os.path.join(DATA_DIR, name))
+
+# ================== 时钟 ==================
+class Clock:
+    # 调度用时钟：speed>1 时为按倍速流逝的虚拟时间，sleep 按倍速缩短
+
+    def __init__(self, speed=1.0):
+        self.speed = max(speed, 1e-9)
+        self._real0 = time.time()
+
+    def time(self):
+        if self.speed == 1:
+            return time.time()
+        return self._real0 + (time.time() - self._real0) * self.speed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+CLOCK = Clock(SIM_SPEED if DELIVERY_BACKEND == "simulated" else 1.0)
+
+# ================== 性能追踪 ==================
+TRACE_FILE = os.getenv("TRACE_FILE", "")   # 设置后逐封记录各阶段耗时（JSONL），也可用 /admin/trace 开关
+TRACE_DIR = os.path.join(DATA_DIR, "traces")   # /admin/trace 只能在该目录下按文件名开启追踪
+PROFILE_MAX_SECONDS = 60
+
+class Tracer:
+    # 逐封邮件的阶段耗时（毫秒），按线程收集，发送结束时写一行 JSON 到追踪文件。未启用时各方法直接返回
+
+    def __init__(self, path=""):
+        self.lock = Lock()
+        self._local = local()
+        self._fh = None
+        self.path = ""
+        if path:
+            self.start(path)
+
+    @property
+    def enabled(self):
+        return self._fh is not None
+
+    def start(self, path):
+        with self.lock:
+            if self._fh: self._fh.close()
+            self._fh = open(path, 'a', encoding='utf-8')
+            self.path = path
+
+    def stop(self):
+        with self.lock:
+            if self._fh: self._fh.close()
+            self._fh = None
+
+    def begin(self):
+        if self._fh:
+            self._local.trace = {"t0": time.perf_counter(), "spans": []}
+
+    def discard(self):
+        self._local.trace = None
+
+    def add(self, name, ms):
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace["spans"].append([name, round(ms, 3)])
+
+    @contextmanager
+    def span(self, name):
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace["spans"].append([name, round((time.perf_counter() - t0) * 1000, 3)])
+
+    def end(self, **attrs):
+        trace = getattr(self._local, "trace", None)
+        self._local.trace = None
+        if trace is None:
+            return
+        line = json.dumps({"ts": datetime.datetime.utcnow().isoformat(), "thread": get_ident(),
+                           "total_ms": round((time.perf_counter() - trace["t0"]) * 1000, 3),
+                           "spans": trace["spans"], **attrs}, ensure_ascii=False)
+        with self.lock:
+            if self._fh:
+                self._fh.write(line + "\n")
+                self._fh.flush()
+
+TRACER = Tracer(TRACE_FILE)
+
+class TimedLock:
+    # 记录等待时间的互斥锁：无竞争时只计数，有竞争时累计等待时长并写入当前追踪
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = Lock()
+        self.stats = {"acquires": 0, "contended": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self.stats["acquires"] += 1
+            return True
+        if not blocking:
+            return False
+        t0 = time.perf_counter()
+        if not self._lock.acquire(True, timeout):
+            return False
+        waited = (time.perf_counter() - t0) * 1000
+        # 已持有锁，更新统计无需再加锁
+        st = self.stats
+        st["acquires"] += 1
+        st["contended"] += 1
+        st["wait_ms_total"] += waited
+        st["wait_ms_max"] = max(st["wait_ms_max"], waited)
+        TRACER.add("lock_wait:" + self.name, waited)
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+WORKER_THREADS = set()   # 发送线程 ident，采样分析默认只看这些线程
+
+def sample_stacks(seconds, interval=0.005, all_threads=False):
+    # 采样线程栈 seconds 秒，返回 collapsed 格式（"帧;帧;帧 次数"），可直接生成火焰图
+    counts = {}
+    me = get_ident()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (not all_threads and ident not in WORKER_THREADS):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return "\n".join(f"{k} {v}" for k, v in sorted(counts.items(), key=lambda kv: -kv[1]))
 
 # ================== 账号加载 ==================
 def load_accounts_from_env():
@@ -45,70 +252,536 @@ ACCOUNTS = load_accounts_from_env()
 current_index = 0
 
 # ================== 用量持久化 ==================
-account_usage = {}
-last_reset_date = datetime.date.today()
-
-if os.path.exists(USAGE_FILE_JSON):
-    try:
-        with open(USAGE_FILE_JSON,'r',encoding='utf-8') as f:
-            account_usage = json.load(f)
-    except:
-        account_usage = {}
-
+class QuotaTracker:
+    # 账号配额：按时间分桶计数并持久化；calendar 按 tz 自然日、rolling 按最近 24 小时
+    DAY = 86400
+
+    def __init__(self, path, limit, mode="calendar", tz="Asia/Shanghai", bucket_seconds=300, flush_seconds=5):
+        self.path = path
+        self.limit = limit
+        self.mode = mode
+        try:
+            self.tz = ZoneInfo(tz)
+        except Exception:
+            self.tz = datetime.timezone(datetime.timedelta(hours=8))
+        self.bucket = bucket_seconds
+        self.flush_seconds = flush_seconds
+        self.lock = Lock()
+        self.buckets = {}   # 账号 -> deque[[桶起始, 次数]]
+        self.totals = {}    # 账号 -> 窗口内合计
+        self._saved_at = 0.0
+        self._dirty = False
+
+    def _window_start(self, now):
+        if self.mode == "rolling":
+            return now - self.DAY
+        day = datetime.datetime.fromtimestamp(now, self.tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        return day.timestamp()
+
+    def _expire(self, acc, now):
+        q = self.buckets.get(acc)
+        if not q:
+            return 0
+        start = self._window_start(now)
+        while q and q[0][0] + self.bucket <= start:
+            self.totals[acc] -= q.popleft()[1]
+        return self.totals[acc]
+
+    def ensure(self, acc):
+        with self.lock:
+            self.buckets.setdefault(acc, deque())
+            self.totals.setdefault(acc, 0)
+
+    def forget(self, *accs):
+        with self.lock:
+            for acc in accs:
+                self.buckets.pop(acc, None)
+                self.totals.pop(acc, None)
+            self._dirty = True
+        self.maybe_save(force=True)
+
+    def _add(self, acc, n, now):
+        # 计入 n 次并返回所在桶的起始时间（调用方持有 self.lock）
+        q = self.buckets.setdefault(acc, deque())
+        self.totals.setdefault(acc, 0)
+        b = now - now % self.bucket
+        if q and q[-1][0] == b:
+            q[-1][1] += n
+        else:
+            q.append([b, n])
+        self.totals[acc] += n
+        self._dirty = True
+        return b
+
+    def record(self, acc, n=1, now=None):
+        now = CLOCK.time() if now is None else now
+        with self.lock:
+            self._add(acc, n, now)
+        self.maybe_save()
+
+    def reserve(self, acc, now=None):
+        # 同一把锁内检查并占用一个名额，返回所在桶起始时间供 cancel 退回；配额已满返回 None
+        now = CLOCK.time() if now is None else now
+        with self.lock:
+            if self._expire(acc, now) >= self.limit:
+                return None
+            slot = self._add(acc, 1, now)
+        self.maybe_save()
+        return slot
+
+    def cancel(self, acc, slot):
+        # 退回 reserve 占用的名额；所在桶已过期则无需处理
+        with self.lock:
+            for bucket in reversed(self.buckets.get(acc, ())):
+                if bucket[0] == slot:
+                    if bucket[1] > 0:
+                        bucket[1] -= 1
+                        self.totals[acc] -= 1
+                        self._dirty = True
+                    break
+                if bucket[0] < slot:
+                    break
+        self.maybe_save()
+
+    def used(self, acc, now=None):
+        now = CLOCK.time() if now is None else now
+        with self.lock:
+            return self._expire(acc, now)
+
+    def remaining(self, acc, now=None):
+        return max(0, self.limit - self.used(acc, now))
+
+    def next_slot_at(self, acc, now=None):
+        # 该账号下一次有配额的时间戳；当前就有配额则返回 now
+        now = CLOCK.time() if now is None else now
+        with self.lock:
+            used = self._expire(acc, now)
+            if used < self.limit:
+                return now
+            if self.mode != "rolling":
+                return self.next_reset_at(now)
+            # 滚动窗口：找到让用量降到上限以下需要过期的最后一个桶
+            excess = used - self.limit + 1
+            for b, n in self.buckets[acc]:
+                excess -= n
+                if excess <= 0:
+                    return b + self.bucket + self.DAY
+            return now
+
+    def next_reset_at(self, now):
+        # 窗口整体刷新的时间：自然日为下一个零点，滚动窗口为 now 之后 24 小时
+        if self.mode == "rolling":
+            return now + self.DAY
+        day = datetime.datetime.fromtimestamp(now, self.tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        return (day + datetime.timedelta(days=1)).timestamp()
+
+    def usage(self, now=None):
+        now = CLOCK.time() if now is None else now
+        with self.lock:
+            return {acc: self._expire(acc, now) for acc in self.buckets}
+
+    def snapshot(self, now=None):
+        # /get-usage 用：每个账号的已用、剩余和下一个可用时间
+        now = CLOCK.time() if now is None else now
+        out = {}
+        for acc, used in self.usage(now).items():
+            slot = self.next_slot_at(acc, now)
+            out[acc] = {"used": used, "remaining": max(0, self.limit - used),
+                        "next_slot_at": datetime.datetime.fromtimestamp(slot, self.tz).isoformat()}
+        return out
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path,'r',encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return
+        with self.lock:
+            if data.get("version") == 2:
+                # 未来时间的桶（时钟回拨或之前的加速演练）_expire 永远不会弹出，直接丢弃
+                horizon = CLOCK.time() + self.bucket
+                for acc, rows in data.get("buckets", {}).items():
+                    rows = [[b, n] for b, n in rows if b < horizon]
+                    self.buckets[acc] = deque(rows)
+                    self.totals[acc] = sum(n for _, n in rows)
+                return
+        # 旧格式 {账号: 次数} 不知道发生时间，保守地记在当前时间桶
+        for acc, n in data.items():
+            if isinstance(n, int) and n > 0:
+                self.record(acc, n)
+
+    def maybe_save(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not self._dirty or (not force and now - self._saved_at < self.flush_seconds):
+                return
+            data = {"version": 2, "mode": self.mode, "bucket_seconds": self.bucket,
+                    "buckets": {acc: list(q) for acc, q in self.buckets.items()}}
+            self._dirty = False
+            self._saved_at = now
+        tmp = self.path + ".tmp"
+        with open(tmp,'w',encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+QUOTA = QuotaTracker(USAGE_FILE_JSON, DAILY_LIMIT, QUOTA_MODE, QUOTA_TZ, QUOTA_BUCKET_SECONDS, QUOTA_FLUSH_SECONDS)
+QUOTA.load()
 for acc in ACCOUNTS:
-    account_usage.setdefault(acc['email'], 0)
+    QUOTA.ensure(acc['email'])
 
 def save_usage():
-    with open(USAGE_FILE_JSON,'w',encoding='utf-8') as f:
-        json.dump(account_usage,f,ensure_ascii=False,indent=2)
+    QUOTA.maybe_save(force=True)
 
 # ================== 收件人 ==================
-RECIPIENTS = []
-SENT_RECIPIENTS = []
+RECIPIENTS = RecipientStore()
+SENT_RECIPIENTS = RecipientStore()
+
+# ================== 去重 / 退订索引 ==================
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+class BloomFilter:
+    # 定长 Bloom 过滤器，blake2b 双重哈希
+    __slots__ = ("m", "k", "count", "bits")
+
+    def __init__(self, capacity, error_rate, m=None, k=None, count=0, bits=None):
+        self.m = m or max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.k = k or max(1, int(round(self.m / capacity * math.log(2))))
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((self.m + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        for i in range(self.k):
+            yield (h1 + i * h2) % self.m
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+class SentIndex:
+    # 已发送历史：可扩容的分片 Bloom 过滤器（极低概率误判），持久化到 SENT_BLOOM_FILE
+    MAGIC = b"MBF1"
+
+    def __init__(self, capacity=SENT_BLOOM_CAPACITY, error_rate=SENT_BLOOM_ERROR):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = [BloomFilter(capacity, error_rate)]
+
+    def add(self, email):
+        key = normalize_email(email)
+        if not key or key in self:
+            return
+        if self.filters[-1].count >= self.capacity:
+            self.filters.append(BloomFilter(self.capacity, self.error_rate))
+        self.filters[-1].add(key)
+
+    def __contains__(self, email):
+        key = normalize_email(email)
+        return any(key in f for f in self.filters)
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(self.MAGIC + struct.pack('<I', len(self.filters)))
+            for flt in self.filters:
+                f.write(struct.pack('<QIQ', flt.m, flt.k, flt.count))
+                f.write(flt.bits)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'rb') as f:
+                if f.read(4) != self.MAGIC:
+                    return
+                (n,) = struct.unpack('<I', f.read(4))
+                filters = []
+                for _ in range(n):
+                    m, k, count = struct.unpack('<QIQ', f.read(20))
+                    bits = bytearray(f.read((m + 7) // 8))
+                    filters.append(BloomFilter(self.capacity, self.error_rate, m=m, k=k, count=count, bits=bits))
+            if filters:
+                self.filters = filters
+        except Exception as e:
+            print("加载已发送索引失败，将按 sent 列表重建:", e)
+
+PENDING_INDEX = set()      # 待发送（含发送中）地址，规范化后精确去重
+SENT_INDEX = SentIndex()   # 已发送历史
+SUPPRESSED = set()         # 退订/屏蔽名单，精确匹配
+
+def load_suppression():
+    SUPPRESSED.clear()
+    if os.path.exists(SUPPRESSION_FILE):
+        with open(SUPPRESSION_FILE,'r',encoding='utf-8') as f:
+            SUPPRESSED.update(normalize_email(line) for line in f if line.strip())
+
+def add_suppressed(emails):
+    # 追加退订地址，返回新增数量；名单文件只追加不重写
+    new = []
+    for e in emails:
+        key = normalize_email(e)
+        if key and key not in SUPPRESSED:
+            SUPPRESSED.add(key)
+            new.append(key)
+    if new:
+        with open(SUPPRESSION_FILE,'a',encoding='utf-8') as f:
+            f.write("\n".join(new) + "\n")
+    return len(new)
+
+def skip_reason(email):
+    # 已发送或已退订时返回原因，否则返回 None
+    key = normalize_email(email)
+    if key in SUPPRESSED: return "已退订"
+    if key in SENT_INDEX: return "已发送过"
+    return None
 
 # ================== 发送控制 ==================
 SEND_QUEUE = []
 IS_SENDING = False
 PAUSED = False
-SEND_LOCK = Lock()
+SEND_LOCK = TimedLock("send")
 EVENT_SUBSCRIBERS = []
 
 # ================== 日志 ==================
-SEND_LOGS = []
+def _parse_ts(ts):
+    # 日志时间戳统一按 UTC+8 的 naive 时间比较
+    return datetime.datetime.fromisoformat(ts).replace(tzinfo=None)
+
+class SendLog:
+    # 追加写 JSONL 日志：按天/小时轮转，旧分段后台 gzip；index.json 记每段起始 id 和稀疏偏移标记
+    STRIDE = 256
+
+    def __init__(self, directory, rotate="daily", compress=True, retention_hours=24*7):
+        self.directory = directory
+        self.fmt = "%Y%m%d%H" if rotate == "hourly" else "%Y%m%d"
+        self.compress = compress
+        self.retention = datetime.timedelta(hours=retention_hours)
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = Lock()
+        self.segments = []   # [{"name","stamp","first_id","first_ts","compressed","marks":[[id,offset],...]}]
+        self.next_id = 1
+        self._fh = None
+        self._compressing = set()   # 正在后台压缩的分段名
+
+    # ---- 分段文件 ----
+    def _path(self, seg):
+        return os.path.join(self.directory, seg["name"] + (".jsonl.gz" if seg["compressed"] else ".jsonl"))
+
+    def _open_segment(self, seg):
+        return gzip.open(self._path(seg), 'rb') if seg["compressed"] else open(self._path(seg), 'rb')
+
+    def _save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp,'w',encoding='utf-8') as f:
+            json.dump({"next_id": self.next_id, "segments": self.segments}, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def _scan(self, seg, start_offset=0):
+        # 从 start_offset 顺序扫描分段，补齐标记并返回 (最后 id, 有效结尾偏移)
+        last_id, end = None, start_offset
+        with self._open_segment(seg) as f:
+            f.seek(start_offset)
+            while True:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry_id = json.loads(line)["id"]
+                except Exception:
+                    break
+                if (entry_id - seg["first_id"]) % self.STRIDE == 0 and \
+                        (not seg["marks"] or seg["marks"][-1][0] < entry_id):
+                    seg["marks"].append([entry_id, end])
+                last_id, end = entry_id, end + len(line)
+        return last_id, end
+
+    def _rebuild_index(self):
+        self.segments = []
+        for fname in sorted(os.listdir(self.directory)):
+            if fname.endswith(".jsonl.gz"): name, compressed = fname[:-9], True
+            elif fname.endswith(".jsonl"): name, compressed = fname[:-6], False
+            else: continue
+            if not compressed and os.path.exists(os.path.join(self.directory, fname + ".gz")):
+                continue   # 压缩完成但原文件未删就退出了，以 .gz 为准
+            try:
+                with (gzip.open if compressed else open)(os.path.join(self.directory, fname), 'rb') as f:
+                    first = json.loads(f.readline())
+            except Exception:
+                continue
+            self.segments.append({"name": name, "stamp": name.split('-')[1], "first_id": first["id"],
+                                  "first_ts": first["ts"], "compressed": compressed, "marks": []})
+        self.segments.sort(key=lambda seg: seg["first_id"])
+        for seg in self.segments[:-1]:
+            self._scan(seg)
+        self.next_id = self.segments[-1]["first_id"] if self.segments else 1
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.index_path,'r',encoding='utf-8') as f:
+                data = json.load(f)
+            self.segments = [seg for seg in data["segments"] if os.path.exists(self._path(seg))]
+            self.next_id = data["next_id"]
+        except Exception:
+            self._rebuild_index()
+        if self.segments and not self.segments[-1]["compressed"]:
+            # 索引可能落后于活动分段（异常退出），从最后一个标记起补扫，并截掉残缺的末行
+            seg = self.segments[-1]
+            start = seg["marks"][-1][1] if seg["marks"] else 0
+            last_id, end = self._scan(seg, start)
+            if last_id is not None:
+                self.next_id = max(self.next_id, last_id + 1)
+            with open(self._path(seg), 'r+b') as f:
+                f.truncate(end)
+            self._fh = open(self._path(seg), 'ab')
+        for seg in self.segments[:-1]:
+            self._compress_later(seg)   # 上次退出时没压完的旧分段
+        self._save_index()
+
+    def _compress_later(self, seg):
+        # 在后台线程压缩已关闭的分段，发送路径上不做 gzip。调用方持有 self.lock
+        if self.compress and not seg["compressed"] and seg["name"] not in self._compressing:
+            self._compressing.add(seg["name"])
+            Thread(target=self._compress, args=(seg,), daemon=True).start()
+
+    def _compress(self, seg):
+        # 压缩期间分段仍按 .jsonl 读取；写完临时文件后才在锁内切换为 .gz
+        src = self._path(seg)
+        tmp = src + ".gz.tmp"
+        try:
+            with open(src, 'rb') as fin, gzip.open(tmp, 'wb') as fout:
+                while True:
+                    chunk = fin.read(1 << 20)
+                    if not chunk: break
+                    fout.write(chunk)
+        except OSError as e:
+            print("压缩日志分段失败:", src, e)
+            with self.lock:
+                self._compressing.discard(seg["name"])
+            try: os.remove(tmp)
+            except OSError: pass
+            return
+        with self.lock:
+            self._compressing.discard(seg["name"])
+            if not any(s is seg for s in self.segments):   # 压缩期间已按保留期清理
+                os.remove(tmp)
+                return
+            os.replace(tmp, src + ".gz")
+            seg["compressed"] = True
+            self._save_index()
+        try: os.remove(src)
+        except OSError: pass
+
+    def _rotate(self, stamp, entry_id, ts):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+            self._compress_later(self.segments[-1])
+        seg = {"name": f"send_log-{stamp}-{entry_id:010d}", "stamp": stamp,
+               "first_id": entry_id, "first_ts": ts, "compressed": False, "marks": []}
+        self.segments.append(seg)
+        self._fh = open(self._path(seg), 'ab')
+        # 清理过期分段：下一分段的起始时间早于保留期，说明整段都已过期
+        cutoff = _parse_ts(ts) - self.retention
+        while len(self.segments) > 1 and _parse_ts(self.segments[1]["first_ts"]) < cutoff:
+            old = self.segments.pop(0)
+            try: os.remove(self._path(old))
+            except OSError: pass
+
+    def append(self, msg, now_local):
+        # now_local 为 UTC+8 的 naive 时间
+        with self.lock:
+            entry = {"id": self.next_id, "ts": now_local.isoformat()+"+08:00", "msg": msg}
+            stamp = now_local.strftime(self.fmt)
+            rotated = not self.segments or self.segments[-1]["stamp"] != stamp or self._fh is None
+            if rotated:
+                self._rotate(stamp, entry["id"], entry["ts"])
+            seg = self.segments[-1]
+            offset = self._fh.tell()
+            self._fh.write((json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8'))
+            self._fh.flush()
+            self.next_id += 1
+            if (entry["id"] - seg["first_id"]) % self.STRIDE == 0:
+                seg["marks"].append([entry["id"], offset])
+                self._save_index()
+            elif rotated:
+                self._save_index()
+            return entry
+
+    # ---- 读取 ----
+    def _read_range(self, lo, hi):
+        out = []
+        for i, seg in enumerate(self.segments):
+            seg_end = self.segments[i+1]["first_id"] if i+1 < len(self.segments) else self.next_id
+            if seg_end <= lo or seg["first_id"] >= hi:
+                continue
+            start = 0
+            for mark_id, offset in seg["marks"]:
+                if mark_id > lo: break
+                start = offset
+            with self._open_segment(seg) as f:
+                f.seek(start)
+                for line in f:
+                    entry = json.loads(line)
+                    if entry["id"] >= hi: break
+                    if entry["id"] >= lo: out.append(entry)
+        return out
+
+    def read(self, since=None, before=None, limit=200):
+        # since: 返回 id > since 的最早 limit 条；否则返回 id < before（默认最新）的最近 limit 条
+        limit = min(max(1, limit), 1000)
+        with self.lock:
+            first = self.segments[0]["first_id"] if self.segments else self.next_id
+            if since is not None:
+                lo = max(since + 1, first)
+                hi = min(lo + limit, self.next_id)
+            else:
+                hi = self.next_id if before is None else max(first, min(before, self.next_id))
+                lo = max(first, hi - limit)
+            logs = self._read_range(lo, hi) if lo < hi else []
+            return {"logs": logs, "first_id": first, "last_id": self.next_id - 1,
+                    "has_more_before": lo > first, "has_more_after": hi < self.next_id}
+
+    def close(self):
+        with self.lock:
+            if self._fh:
+                self._fh.close()
+                self._fh = None
+            self._save_index()
+
+SEND_LOG = SendLog(LOG_DIR, LOG_ROTATE, LOG_COMPRESS, LOG_RETENTION_HOURS)
 
 def load_logs():
-    global SEND_LOGS
-    if os.path.exists(LOG_FILE_JSON):
+    SEND_LOG.open()
+    if SEND_LOG.next_id == 1 and os.path.exists(LOG_FILE_JSON):
+        # 迁移旧的 send_log.json
         try:
             with open(LOG_FILE_JSON,'r',encoding='utf-8') as f:
-                SEND_LOGS = json.load(f)
-        except:
-            SEND_LOGS = []
-    else:
-        SEND_LOGS = []
+                for entry in json.load(f):
+                    SEND_LOG.append(entry['msg'], _parse_ts(entry['ts']))
+            os.replace(LOG_FILE_JSON, LOG_FILE_JSON + ".migrated")
+        except Exception as e:
+            print("迁移旧日志失败:", e)
 
-def save_logs():
-    with open(LOG_FILE_JSON,'w',encoding='utf-8') as f:
-        json.dump(SEND_LOGS,f,ensure_ascii=False,indent=2)
-        
 def cleanup():
     save_recipients()
-    save_logs()
+    save_idempotency()
+    SENT_INDEX.save(SENT_BLOOM_FILE)
+    SEND_LOG.close()
     save_usage()
 
 atexit.register(cleanup)
 
 # ================== 辅助 ==================
-def reset_daily_usage_if_needed():
-    global account_usage,last_reset_date
-    today = datetime.date.today()
-    if today != last_reset_date:
-        for k in account_usage.keys():
-            account_usage[k] = 0
-        last_reset_date = today
-        save_usage()
-        append_log("已进入新的一天，账号发送计数已重置。")
-
 def infer_smtp(email):
     domain = email.split('@')[-1].lower().strip()
     if domain in {"outlook.com","hotmail.com","live.com","msn.com","outlook.cn"}: return ("smtp.office365.com",587)
@@ -116,90 +789,426 @@ def infer_smtp(email):
     return ("smtp."+domain,587)
 
 def get_next_account():
+    # 轮询选出有配额的账号并预占名额，返回 (账号, 名额)；发送失败须 QUOTA.cancel 退回
     global current_index
-    selected_accounts = [acc for acc in ACCOUNTS if acc.get("selected",True)]
-    if not selected_accounts: return None
-    for _ in range(len(selected_accounts)):
-        acc = selected_accounts[current_index % len(selected_accounts)]
-        current_index = (current_index+1) % len(selected_accounts)
-        count = account_usage.get(acc['email'],0)
-        if count < DAILY_LIMIT: return acc
-    return None
-
-def send_email(account,to_email,subject,body):
-    try:
+    with SEND_LOCK:
+        selected_accounts = [acc for acc in ACCOUNTS if acc.get("selected",True)]
+        if not selected_accounts: return None, None
+        for _ in range(len(selected_accounts)):
+            acc = selected_accounts[current_index % len(selected_accounts)]
+            current_index = (current_index+1) % len(selected_accounts)
+            slot = QUOTA.reserve(acc['email'])
+            if slot is not None: return acc, slot
+    return None, None
+
+def next_account_wait(cap=60):
+    # 距离最早有配额的已启用账号还需等待的秒数，最多 cap 秒
+    now = CLOCK.time()
+    slots = [QUOTA.next_slot_at(acc['email'], now) for acc in ACCOUNTS if acc.get("selected",True)]
+    if not slots: return cap
+    return max(1, min(cap, int(math.ceil(min(slots) - now))))
+
+def smtp_error_code(e):
+    # 取 SMTP 异常中的响应码，无响应码（连接错误等）返回 None
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in e.recipients.values()]
+        return codes[0] if codes else None
+    return getattr(e, 'smtp_code', None)
+
+# ================== 投递后端 ==================
+class SmtpBackend:
+    # 真实 SMTP 投递。失败时抛出 smtplib 异常，由 send_email 统一处理
+    name = "smtp"
+
+    def deliver(self, account, to_email, msg):
         smtp_server,smtp_port = infer_smtp(account['email'])
         if 'smtp_server' in account: smtp_server = account['smtp_server']
         if 'smtp_port' in account: smtp_port = int(account['smtp_port'])
+        with TRACER.span("smtp_connect"):
+            server = smtplib.SMTP(smtp_server,smtp_port)
+        with TRACER.span("smtp_starttls"):
+            server.starttls()
+        with TRACER.span("smtp_login"):
+            server.login(account['email'],account['app_password'])
+        with TRACER.span("smtp_send"):
+            server.sendmail(account['email'],[to_email],msg.as_string())
+        with TRACER.span("smtp_quit"):
+            server.quit()
+
+class SimulatedBackend:
+    # 模拟投递：按对数正态延迟耗费虚拟时间，按比例返回 4xx/5xx，不建连接；profile 可按账号覆盖
+    name = "simulated"
+    DEFAULT_PROFILE = {"latency_median_ms": 800, "latency_sigma": 0.5, "throttle_rate": 0.02, "failure_rate": 0.01}
+
+    def __init__(self, profile=None):
+        self.profile = {**self.DEFAULT_PROFILE, **(profile or {})}
+
+    def _profile(self, email):
+        return {**self.profile, **self.profile.get("accounts", {}).get(email, {})}
+
+    def deliver(self, account, to_email, msg):
+        p = self._profile(account['email'])
+        with TRACER.span("sim_deliver"):
+            CLOCK.sleep(random.lognormvariate(math.log(p["latency_median_ms"] / 1000.0), p["latency_sigma"]))
+        roll = random.random()
+        if roll < p["throttle_rate"]:
+            raise smtplib.SMTPResponseException(421, b"simulated: too many messages, try again later")
+        if roll < p["throttle_rate"] + p["failure_rate"]:
+            raise smtplib.SMTPRecipientsRefused({to_email: (550, b"simulated: mailbox unavailable")})
+
+DELIVERY = SimulatedBackend(SIM_PROFILE) if DELIVERY_BACKEND == "simulated" else SmtpBackend()
+
+def send_email(account,to_email,subject,body):
+    try:
         msg = MIMEText(body,'plain','utf-8')
         msg['From'] = account['email']
         msg['To'] = to_email
         msg['Subject'] = Header(subject,'utf-8')
-        server = smtplib.SMTP(smtp_server,smtp_port)
-        server.starttls()
-        server.login(account['email'],account['app_password'])
-        server.sendmail(account['email'],[to_email],msg.as_string())
-        server.quit()
-        account_usage[account['email']] = account_usage.get(account['email'],0)+1
-        save_usage()
-        return True,''
+        DELIVERY.deliver(account, to_email, msg)
+        return True,'',None
     except Exception as e:
-        return False,str(e)
+        return False,str(e),smtp_error_code(e)
+
+class DeliveryStats:
+    # 按虚拟时间分钟统计投递结果，用于吞吐和完成时间预估
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = None
+        self.last = None       # 最近一次投递结果的时间
+        self.per_minute = {}   # 分钟 -> 成功数
+        self.totals = {"sent": 0, "deferred": 0, "failed": 0}
+
+    def record(self, outcome, now=None):
+        now = CLOCK.time() if now is None else now
+        with self.lock:
+            if self.started is None:
+                self.started = now
+            self.last = now
+            self.totals[outcome] += 1
+            if outcome == "sent":
+                minute = int(now // 60)
+                self.per_minute[minute] = self.per_minute.get(minute, 0) + 1
+
+    def report(self, pending, now=None):
+        now = CLOCK.time() if now is None else now
+        with self.lock:
+            totals = dict(self.totals)
+            started, last = self.started, self.last
+            peak = max(self.per_minute.values(), default=0)
+        # 没有待发/发送中的收件人时只算到最后一次投递，空闲时间不摊薄平均吞吐
+        end = now if pending else last
+        elapsed = max(end - started, 1.0) if started else 0.0
+        avg = totals["sent"] / (elapsed / 60) if elapsed else 0.0
+        selected = [acc['email'] for acc in ACCOUNTS if acc.get("selected",True)]
+        remaining_quota = sum(QUOTA.remaining(e, now) for e in selected)
+        daily_capacity = len(selected) * QUOTA.limit
+        eta = None
+        if pending and avg > 0 and daily_capacity:
+            if pending <= remaining_quota:
+                eta = now + pending / avg * 60
+            else:
+                # 当前窗口配额用完后等下一个窗口，之后每个窗口发 daily_capacity 条，最后一段按平均吞吐
+                exhausted = now + remaining_quota / avg * 60
+                reset = QUOTA.next_reset_at(started if QUOTA.mode == "rolling" else now)
+                windows, tail = divmod(pending - remaining_quota, daily_capacity)
+                eta = max(reset, exhausted) + windows * QuotaTracker.DAY + tail / avg * 60
+        fmt = lambda ts: datetime.datetime.fromtimestamp(ts, QUOTA.tz).isoformat() if ts else None
+        return {"backend": DELIVERY.name, "speed": CLOCK.speed, **totals,
+                "started_at": fmt(started), "last_outcome_at": fmt(last), "now": fmt(now),
+                "elapsed_seconds": round(elapsed, 1),
+                "avg_per_minute": round(avg, 2), "peak_per_minute": peak,
+                "pending": pending, "accounts": len(selected), "daily_limit": QUOTA.limit,
+                "remaining_quota": remaining_quota, "projected_completion": fmt(eta),
+                "projected_hours_left": round((eta - now) / 3600, 2) if eta else None}
+
+DELIVERY_STATS = DeliveryStats()
+
+# ================== 按收件域名调度 ==================
+def recipient_domain(email):
+    return (email or "").rsplit('@', 1)[-1].strip().lower()
+
+class DomainBacklog:
+    # 某个域名预取队列已满时从 RECIPIENTS 取出的收件人：紧凑存储，并记下取出序号以便还原原顺序
+    __slots__ = ("store", "seqs", "head")
+
+    def __init__(self):
+        self.store = RecipientStore()
+        self.seqs = array('Q')
+        self.head = 0
+
+    def __len__(self):
+        return len(self.store)
+
+    def append(self, rec, seq):
+        self.store.append(rec)
+        self.seqs.append(seq)
+
+    def popleft(self):
+        seq = self.seqs[self.head]
+        self.head += 1
+        if self.head >= RecipientStore.COMPACT_MIN and self.head * 2 >= len(self.seqs):
+            del self.seqs[:self.head]
+            self.head = 0
+        return self.store.popleft(), seq
+
+    def snapshot(self):
+        # [(序号, 收件人)] 的惰性快照；只在锁内做切片，解码留到迭代时
+        return zip(self.seqs[self.head:], self.store.copy())
+
+    def remove_if(self, predicate, jobs=None):
+        kept = DomainBacklog()
+        for seq, rec in self.snapshot():
+            if not predicate(rec["email"]):
+                kept.append(rec, seq)
+            elif jobs is not None and rec.get("job"):
+                jobs[rec["job"]] += 1
+        removed = len(self) - len(kept)
+        if removed:
+            self.store, self.seqs, self.head = kept.store, kept.seqs, 0
+        return removed
+
+class DomainDispatcher:
+    # 按收件域名分组调度：限并发/速率、轮询交错发送，满额域名进积压区；锁顺序先 self.lock 再 SEND_LOCK
+
+    def __init__(self, limits, default_limit, lookahead=DISPATCH_LOOKAHEAD, stage_cap=DOMAIN_STAGE_CAP):
+        self.lock = TimedLock("dispatcher")
+        self.limits = limits
+        self.default_limit = default_limit
+        self.lookahead = lookahead
+        self.stage_cap = stage_cap
+        self.queues = {}       # 域名 -> deque[(收件人, 入队时刻 perf_counter, 取出序号)]
+        self.overflow = {}     # 域名 -> DomainBacklog
+        self.ring = deque()    # 有待发收件人的域名，轮询顺序
+        self.state = {}        # 域名 -> {"inflight","tokens","updated","backoff","backoff_until"}
+        self.staged = 0
+        self.backlog = 0
+        self.inflight = 0
+        self._seq = itertools.count()
+
+    def _limit(self, domain):
+        return {**self.default_limit, **self.limits.get(domain, {})}
+
+    def _state(self, domain):
+        st = self.state.get(domain)
+        if st is None:
+            st = self.state[domain] = {"inflight": 0, "tokens": 1.0, "updated": CLOCK.time(),
+                                       "backoff": 0, "backoff_until": 0.0}
+        return st
+
+    def _stage(self, rec, seq=None, front=False):
+        domain = recipient_domain(rec["email"])
+        q = self.queues.get(domain)
+        if q is None:
+            q = self.queues[domain] = deque()
+            self.ring.append(domain)
+        item = (rec, time.perf_counter(), next(self._seq) if seq is None else seq)
+        if front: q.appendleft(item)
+        else: q.append(item)
+        self.staged += 1
+
+    def _topup(self, domain):
+        # 从积压区补齐该域名队列；队列和积压区都空了就移出轮询
+        q, backlog = self.queues[domain], self.overflow.get(domain)
+        while backlog and len(q) < self.stage_cap:
+            rec, seq = backlog.popleft()
+            q.append((rec, time.perf_counter(), seq))
+            self.backlog -= 1
+            self.staged += 1
+        if backlog is not None and not backlog:
+            del self.overflow[domain]
+        if not q:
+            del self.queues[domain]
+            self.ring.remove(domain)
+
+    def _refill(self):
+        # 预取和积压合计不超过 lookahead：主导域名的队列满了也不会把 RECIPIENTS 整个搬进积压区
+        room = self.lookahead - self.staged - self.backlog
+        if room <= 0:
+            return
+        with SEND_LOCK:
+            for _ in range(min(room, len(RECIPIENTS))):
+                rec, seq = RECIPIENTS.popleft(), next(self._seq)
+                domain = recipient_domain(rec["email"])
+                q = self.queues.get(domain)
+                if q is not None and len(q) >= self.stage_cap:
+                    backlog = self.overflow.get(domain)
+                    if backlog is None:
+                        backlog = self.overflow[domain] = DomainBacklog()
+                    backlog.append(rec, seq)
+                    self.backlog += 1
+                    continue
+                self._stage(rec, seq)
+
+    def _ready_at(self, domain, now):
+        # 该域名下一次可发送的时间；并发已满返回 None（等 release）
+        st, lim = self._state(domain), self._limit(domain)
+        if st["inflight"] >= max(1, lim["concurrency"]):
+            return None
+        ready = st["backoff_until"]
+        rate = lim.get("per_minute") or 0
+        if rate > 0:
+            burst = max(1, lim.get("burst", 1))
+            st["tokens"] = min(burst, st["tokens"] + (now - st["updated"]) * rate / 60.0)
+            st["updated"] = now
+            if st["tokens"] < 1:
+                ready = max(ready, now + (1 - st["tokens"]) * 60.0 / rate)
+        return ready
+
+    def acquire(self):
+        # 返回 (收件人, 域名, 等待秒数)。全部发完返回 (None, None, None)；暂无可发返回建议等待秒数
+        with self.lock:
+            self._refill()
+            now = CLOCK.time()
+            wait = None
+            for _ in range(len(self.ring)):
+                domain = self.ring[0]
+                self.ring.rotate(-1)
+                ready = self._ready_at(domain, now)
+                if ready is None:
+                    continue
+                if ready > now:
+                    wait = ready - now if wait is None else min(wait, ready - now)
+                    continue
+                rec, staged_at, _ = self.queues[domain].popleft()
+                TRACER.add("queue_wait", (time.perf_counter() - staged_at) * 1000)
+                self.staged -= 1
+                self._topup(domain)
+                st = self._state(domain)
+                st["inflight"] += 1
+                if self._limit(domain).get("per_minute"):
+                    st["tokens"] -= 1
+                self.inflight += 1
+                return rec, domain, 0
+            if not self.staged and not self.inflight:
+                return None, None, None
+            return None, None, min(wait if wait is not None else 1.0, 1.0)
+
+    def release(self, domain, requeue=None, deferred=False):
+        # 发送结束后归还并发名额；requeue 放回该域名队列（延迟则放队尾，否则放队首）
+        with self.lock:
+            st = self._state(domain)
+            st["inflight"] -= 1
+            self.inflight -= 1
+            if deferred:
+                st["backoff"] = min(DEFER_BACKOFF_MAX, st["backoff"] * 2 or DEFER_BACKOFF_BASE)
+                st["backoff_until"] = CLOCK.time() + st["backoff"]
+            elif requeue is None:
+                st["backoff"] = 0
+            if requeue is not None:
+                self._stage(requeue, front=not deferred)
+            return st["backoff"]
+
+    def staged_records(self):
+        # 预取和积压中的收件人，按原顺序惰性迭代（调用方持有 self.lock；迭代可在锁外进行）
+        parts = [sorted(((seq, rec) for rec, _, seq in q), key=lambda x: x[0]) for q in self.queues.values()]
+        parts += [backlog.snapshot() for backlog in self.overflow.values()]
+        return (rec for _, rec in heapq.merge(*parts, key=lambda x: x[0]))
+
+    def remove_if(self, predicate, jobs=None):
+        # 按 email 删除预取和积压中的收件人（调用方持有 self.lock），返回删除条数；jobs 同 RecipientStore.remove_if
+        removed = 0
+        for domain in list(self.queues):
+            q, kept = self.queues[domain], deque()
+            for item in q:
+                if not predicate(item[0]["email"]):
+                    kept.append(item)
+                elif jobs is not None and item[0].get("job"):
+                    jobs[item[0]["job"]] += 1
+            removed += len(q) - len(kept)
+            self.staged -= len(q) - len(kept)
+            self.queues[domain] = kept
+            backlog = self.overflow.get(domain)
+            if backlog:
+                n = backlog.remove_if(predicate, jobs)
+                removed += n
+                self.backlog -= n
+            self._topup(domain)
+        return removed
+
+    def drain(self):
+        # 停止发送时把预取和积压的收件人按原顺序放回 RECIPIENTS 队首
+        with self.lock:
+            records = self.staged_records()
+            with SEND_LOCK:
+                RECIPIENTS.extendleft(records)
+            self.queues.clear()
+            self.overflow.clear()
+            self.ring.clear()
+            self.staged = self.backlog = 0
+
+    def stats(self):
+        with self.lock:
+            now = CLOCK.time()
+            return {"staged": self.staged, "backlog": self.backlog, "inflight": self.inflight, "domains": {
+                domain: {"staged": len(self.queues.get(domain, ())), "backlog": len(self.overflow.get(domain, ())),
+                         "inflight": st["inflight"],
+                         "backoff_remaining": max(0, round(st["backoff_until"] - now, 1)),
+                         **self._limit(domain)}
+                for domain, st in self.state.items() if domain in self.queues or st["inflight"]}}
+
+DISPATCHER = DomainDispatcher(DOMAIN_LIMITS, DOMAIN_DEFAULT_LIMIT)
 
 # ================== 收件人持久化 ==================
+def _dump_records(f, records):
+    # 逐条写出，避免百万级列表一次性物化成 dict
+    first = True
+    for r in records:
+        f.write('\n' if first else ',\n')
+        f.write(json.dumps(r, ensure_ascii=False))
+        first = False
+
+SAVE_LOCK = TimedLock("save")
+
+def pending_snapshot():
+    # 未发送收件人快照：调度器预取中的在前，队列中的在后
+    with DISPATCHER.lock, SEND_LOCK:
+        return DISPATCHER.staged_records(), RECIPIENTS.copy()
+
 def save_recipients():
-    with open(RECIPIENTS_FILE,'w',encoding='utf-8') as f:
-        json.dump({"pending":RECIPIENTS,"sent":SENT_RECIPIENTS},f,ensure_ascii=False,indent=2)
+    with DISPATCHER.lock, SEND_LOCK:
+        staged = DISPATCHER.staged_records()
+        pending = RECIPIENTS.copy()
+        sent = SENT_RECIPIENTS.copy()
+    with SAVE_LOCK:
+        tmp = RECIPIENTS_FILE + ".tmp"
+        with open(tmp,'w',encoding='utf-8') as f:
+            f.write('{"pending": [')
+            _dump_records(f, itertools.chain(staged, pending))
+            f.write('],\n"sent": [')
+            _dump_records(f, sent)
+            f.write(']}\n')
+        os.replace(tmp, RECIPIENTS_FILE)
+    save_jobs()
 
 def load_recipients():
-    global RECIPIENTS,SENT_RECIPIENTS
+    RECIPIENTS.clear()
+    SENT_RECIPIENTS.clear()
     if os.path.exists(RECIPIENTS_FILE):
         with open(RECIPIENTS_FILE,'r',encoding='utf-8') as f:
             data=json.load(f)
-            RECIPIENTS=data.get('pending',[])
-            SENT_RECIPIENTS=data.get('sent',[])
-    else:
-        RECIPIENTS=[]
-        SENT_RECIPIENTS=[]
+            RECIPIENTS.extend(data.get('pending',[]))
+            SENT_RECIPIENTS.extend(data.get('sent',[]))
+    PENDING_INDEX.clear()
+    PENDING_INDEX.update(normalize_email(r["email"]) for r in RECIPIENTS)
+    # 过滤器文件可能落后于 sent 列表（异常退出），按列表补齐
+    SENT_INDEX.load(SENT_BLOOM_FILE)
+    for r in SENT_RECIPIENTS:
+        SENT_INDEX.add(r["email"])
         
 # ---- 保证启动时总是加载历史数据 ----
 load_recipients()
+load_suppression()
 load_logs()
 
 
 # ================== 后端：24小时内账号统计 ==================
 def append_log(msg):
-    global SEND_LOGS
-    now_utc = datetime.datetime.utcnow()
-    cutoff = now_utc - datetime.timedelta(hours=24)
-    
-    # 清理24小时以上日志
-    valid_logs = []
-    for entry in SEND_LOGS:
-        try:
-            ts = datetime.datetime.fromisoformat(entry['ts'])
-            if ts > cutoff:
-                valid_logs.append(entry)
-        except Exception:
-            continue
-    SEND_LOGS = valid_logs
-
-    entry = {"ts":(now_utc+datetime.timedelta(hours=8)).isoformat()+"+08:00", "msg":msg}
-    SEND_LOGS.append(entry)
-    save_logs()
-    save_usage()
-
-    # 统计24小时内账号发送次数
-    recent_usage = {}
-    for log in SEND_LOGS:
-        text = log['msg']
-        if text.startswith('已发送给'):
-            parts = text.split('使用账号')
-            if len(parts) == 2:
-                acc_email = parts[1].strip(' )')
-                recent_usage[acc_email] = recent_usage.get(acc_email, 0) + 1
-
-    send_event({"log": msg, "usage": recent_usage})
+    now_local = datetime.datetime.utcfromtimestamp(CLOCK.time()) + datetime.timedelta(hours=8)
+    with TRACER.span("log_write"):
+        entry = SEND_LOG.append(msg, now_local)
+    with TRACER.span("event_fanout"):
+        send_event({"log": msg, "log_id": entry["id"], "ts": entry["ts"], "usage": QUOTA.usage()})
 
 # ================== SSE ==================
 def send_event(data):
@@ -288,6 +1297,16 @@ def home():
                         <button class="btn" onclick="exportPending()">导出未发送收件人</button>
                         <button class="btn" onclick="exportSent()">导出已发送收件人</button>
                     </div>
+                    <div class="row">
+                        <textarea id="bulkEmails" style="flex:1; min-width:280px; height:60px;" placeholder="批量删除：每行一个邮箱"></textarea>
+                        <input type="text" id="bulkPattern" placeholder="或通配符，如 *@example.com">
+                        <button class="btn btn-danger" onclick="bulkDeleteRecipients()">批量删除</button>
+                    </div>
+                    <div class="row">
+                        <input type="file" id="suppressionFile">
+                        <button class="btn" onclick="uploadSuppression()">上传退订名单</button>
+                        <span class="muted">导入时自动跳过重复、已发送和已退订的地址</span>
+                    </div>
                 </div>
                 <div class="card" style="margin-top:10px;">
     <h3>收件箱列表</h3>
@@ -342,6 +1361,7 @@ def home():
                 </div>
                 <div class="card" style="margin-top:10px;">
                     <h3>实时发送进度</h3>
+                    <button class="btn" id="olderLogsBtn" style="display:none;" onclick="loadOlderLogs()">加载更早日志</button>
                     <ul id="sendLog"></ul>
                     <h3>账号发送统计</h3>
                     <ul id="accountUsage"></ul>
@@ -360,6 +1380,12 @@ def home():
                 </div>
                 <div class="card" style="margin-top:10px;">
                     <h3>账号列表</h3>
+                    <div class="row" style="margin-bottom:8px;">
+                        <input type="text" id="accountPattern" placeholder="通配符，如 *@gmail.com；留空为全部">
+                        <button class="btn" onclick="bulkAccounts('/bulk-toggle-accounts', {checked:true})">批量启用</button>
+                        <button class="btn" onclick="bulkAccounts('/bulk-toggle-accounts', {checked:false})">批量禁用</button>
+                        <button class="btn btn-danger" onclick="bulkAccounts('/bulk-delete-accounts', {})">批量删除</button>
+                    </div>
                     <div id="accountList"></div>
                 </div>
             </div>
@@ -399,24 +1425,44 @@ def home():
                 });
             }
 
+            function bulkDeleteRecipients(){
+                const emails = document.getElementById('bulkEmails').value;
+                const pattern = document.getElementById('bulkPattern').value;
+                if(!emails.trim() && !pattern.trim()){ alert("请填写邮箱或通配符"); return; }
+                fetch('/bulk-delete-recipients', {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({emails, pattern})})
+                .then(res=>res.json()).then(data=>{ alert(data.message); loadRecipients(); });
+            }
+
+            function uploadSuppression(){
+                const file = document.getElementById('suppressionFile').files[0];
+                if(!file){ alert("请选择文件"); return; }
+                const formData = new FormData();
+                formData.append('file', file);
+                fetch('/upload-suppression', {method:'POST', body:formData})
+                .then(res=>res.json()).then(data=>{
+                    alert(data.message);
+                    loadRecipients();
+                });
+            }
+
            function loadRecipients(){
-    fetch('/recipients').then(res=>res.json()).then(data=>{
+    const perPage = parseInt(document.getElementById('perPage')?.value || 10);
+    let page = parseInt(document.getElementById('currentPage')?.value || 1);
+    if(page < 1) page = 1;
+    // 服务端分页：只拉取当前页
+    fetch(`/recipients?page=${page}&per_page=${perPage}`).then(res=>res.json()).then(data=>{
         const tbody = document.querySelector('#recipientsTable tbody');
         tbody.innerHTML = '';
 
-        const perPage = parseInt(document.getElementById('perPage')?.value || 10);
-        let page = parseInt(document.getElementById('currentPage')?.value || 1);
-
-        const totalPages = Math.ceil(data.pending.length / perPage);
-        if(page > totalPages) page = totalPages;
-        if(page < 1) page = 1;
+        const totalPages = Math.max(1, Math.ceil(data.total / perPage));
+        if(page > totalPages){
+            document.getElementById('currentPage').value = totalPages;
+            loadRecipients();
+            return;
+        }
         document.getElementById('currentPage').value = page;
 
-        const startIdx = (page-1) * perPage;
-        const endIdx = startIdx + perPage;
-        const pageData = data.pending.slice(startIdx, endIdx);
-
-        pageData.forEach((r)=>{
+        data.pending.forEach((r)=>{
             const tr = document.createElement('tr');
             tr.innerHTML = `<td>${r.email}</td><td>${r.name||''}</td><td>${r.real_name||''}</td>`+
                            `<td><button class="danger-link" onclick="deleteRecipient('${r.email}')">删除</button></td>`;
@@ -503,16 +1549,36 @@ function changePage(offset){
                 }
             }
 
+            // 历史日志游标：当前已加载的最早一条 id
+            let oldestLogId = null;
+            function logItem(item){
+                const li = document.createElement('li');
+                li.textContent = '[' + item.ts + '] ' + item.msg;
+                return li;
+            }
+            function setOlderLogs(data){
+                if(data.logs.length) oldestLogId = data.logs[0].id;
+                document.getElementById('olderLogsBtn').style.display = data.has_more_before ? 'inline-block' : 'none';
+            }
+            function loadOlderLogs(){
+                if(oldestLogId === null) return;
+                fetch('/get-logs?before=' + oldestLogId + '&limit=200').then(res=>res.json()).then(data=>{
+                    const log = document.getElementById('sendLog');
+                    const frag = document.createDocumentFragment();
+                    data.logs.forEach(item=>frag.appendChild(logItem(item)));
+                    log.insertBefore(frag, log.firstChild);
+                    setOlderLogs(data);
+                });
+            }
+
             function loadLogsAndUsage(){
-                // 回放历史日志
-                fetch('/get-logs').then(res=>res.json()).then(data=>{
+                // 只回放最近的日志，更早的按需加载
+                fetch('/get-logs?limit=200').then(res=>res.json()).then(data=>{
                     const log = document.getElementById('sendLog');
                     log.innerHTML = '';
-                    data.logs.forEach(item=>{
-                        const li = document.createElement('li');
-                        li.textContent = '[' + item.ts + '] ' + item.msg;
-                        log.appendChild(li);
-                    });
+                    oldestLogId = null;
+                    data.logs.forEach(item=>log.appendChild(logItem(item)));
+                    setOlderLogs(data);
                 });
                 // 读取历史用量
                 fetch('/get-usage').then(res=>res.json()).then(data=>{
@@ -569,6 +1635,19 @@ function changePage(offset){
                 });
             }
 
+            function bulkAccounts(url, extra){
+                const pattern = document.getElementById('accountPattern').value.trim();
+                const action = url === '/bulk-delete-accounts' ? '删除' : (extra.checked ? '启用' : '禁用');
+                if((url === '/bulk-delete-accounts' || !pattern) && !confirm(pattern ? `${action}匹配 ${pattern} 的账号？` : `${action}全部账号？`)) return;
+                const body = Object.assign(pattern ? {pattern} : {all:true}, extra);
+                fetch(url, {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify(body)})
+                .then(res=>res.json()).then(data=>{
+                    alert(data.message);
+                    loadAccountsList();
+                    loadAccounts();
+                });
+            }
+
             function deleteAccount(email){
                 fetch('/delete-account', {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({email})})
                 .then(res=>res.json()).then(data=>{
@@ -605,63 +1684,163 @@ def start_send():
     return jsonify({"message":"邮件发送任务已启动"})
 
 def send_worker_loop():
-    global IS_SENDING, PAUSED
-    while SEND_QUEUE:
-        reset_daily_usage_if_needed()
-        task = SEND_QUEUE[0]
-        subject = task["subject"]
-        body = task["body"]
-        interval = task["interval"]
-
-        if PAUSED:
-            time.sleep(1)
-            continue
-
-        recipient = None
-        with SEND_LOCK:
-            if RECIPIENTS:
-                recipient = RECIPIENTS.pop(0)
+    global IS_SENDING
+    workers = [Thread(target=_send_worker, daemon=True) for _ in range(max(1, SEND_WORKERS))]
+    for t in workers: t.start()
+    for t in workers: t.join()
+    DISPATCHER.drain()
 
-        if not recipient:
-            break
-
-        acc = get_next_account()
-        if not acc:
-            append_log("没有可用账号或账号今日已达上限，等待 60 秒后重试。")
-            time.sleep(60)
-            with SEND_LOCK:
-                RECIPIENTS.insert(0, recipient)
-            continue
-
-        recipient_safe = {
-            "name": recipient.get("name",""),
-            "real_name": recipient.get("real_name","")
-        }
-        try:
-            personalized_subject = subject.format(**recipient_safe)
-            personalized_body = body.format(**recipient_safe)
-        except Exception as e:
-            append_log(f"内容格式错误 {recipient['email']}: {e}")
-            with SEND_LOCK:
-                RECIPIENTS.append(recipient)
-            continue
+    IS_SENDING = False
+    with SEND_LOCK:
+        if SEND_QUEUE:
+            SEND_QUEUE.pop(0)
+    save_recipients()
+    SENT_INDEX.save(SENT_BLOOM_FILE)
 
-        success, err = send_email(acc, recipient["email"], personalized_subject, personalized_body)
-        if success:
+def _send_worker():
+    WORKER_THREADS.add(get_ident())
+    try:
+        while SEND_QUEUE:
+            task = SEND_QUEUE[0]
+
+            if PAUSED:
+                time.sleep(1)
+                continue
+
+            TRACER.begin()
+            recipient, domain, wait = DISPATCHER.acquire()
+            if not recipient:
+                TRACER.discard()
+                if wait is None:
+                    break
+                CLOCK.sleep(wait)   # 可发的域名都在限速/退避中
+                continue
+
+            outcome = _send_one(task, recipient, domain)
+            TRACER.end(email=recipient["email"], domain=domain, outcome=outcome)
+            if outcome in ("sent", "deferred", "failed"):
+                CLOCK.sleep(task["interval"])
+    finally:
+        WORKER_THREADS.discard(get_ident())
+
+def _send_one(task, recipient, domain):
+    # 发送一位收件人，返回结果：sent / deferred / failed / skipped / no_account / format_error
+    reason = skip_reason(recipient["email"])
+    if reason:
+        DISPATCHER.release(domain)
+        with SEND_LOCK:
+            PENDING_INDEX.discard(normalize_email(recipient["email"]))
+        job_progress(recipient.get("job"), "dropped")
+        append_log(f"跳过 {recipient['email']}（{reason}）")
+        return "skipped"
+
+    with TRACER.span("account_select"):
+        acc, slot = get_next_account()
+    if not acc:
+        DISPATCHER.release(domain, requeue=recipient)
+        wait = next_account_wait()
+        append_log(f"没有可用账号或账号配额已用完，等待 {wait} 秒后重试。")
+        CLOCK.sleep(wait)
+        return "no_account"
+
+    recipient_safe = {
+        **recipient.get("vars", {}),
+        "name": recipient.get("name",""),
+        "real_name": recipient.get("real_name","")
+    }
+    try:
+        with TRACER.span("render"):
+            personalized_subject = task["subject"].format(**recipient_safe)
+            personalized_body = task["body"].format(**recipient_safe)
+    except Exception as e:
+        # 先放回队列再归还名额，否则其它 worker 可能看到 staged/inflight 都为 0 而提前退出
+        QUOTA.cancel(acc['email'], slot)
+        with SEND_LOCK:
+            RECIPIENTS.append(recipient)
+        DISPATCHER.release(domain)
+        append_log(f"内容格式错误 {recipient['email']}: {e}")
+        return "format_error"
+
+    success, err, code = send_email(acc, recipient["email"], personalized_subject, personalized_body)
+    if not success:
+        QUOTA.cancel(acc['email'], slot)
+    if success:
+        DISPATCHER.release(domain)
+        with SEND_LOCK:
             SENT_RECIPIENTS.append(recipient)
+            PENDING_INDEX.discard(normalize_email(recipient["email"]))
+            SENT_INDEX.add(recipient["email"])
+        job_progress(recipient.get("job"), "sent")
+        DELIVERY_STATS.record("sent")
+        with TRACER.span("persist"):
             save_recipients()
-            append_log(f"已发送给 {recipient['email']} (使用账号 {acc['email']})")
+        append_log(f"已发送给 {recipient['email']} (使用账号 {acc['email']})")
+        return "sent"
+    if code and 400 <= code < 500:
+        # 临时性延迟：该域名退避，收件人留在域名队列稍后重试，其它域名照常发送
+        backoff = DISPATCHER.release(domain, requeue=recipient, deferred=True)
+        DELIVERY_STATS.record("deferred")
+        append_log(f"发送延迟 {recipient['email']} : {err}（域名 {domain} 退避 {backoff} 秒）")
+        return "deferred"
+    with SEND_LOCK:
+        RECIPIENTS.append(recipient)
+    DISPATCHER.release(domain)
+    DELIVERY_STATS.record("failed")
+    append_log(f"发送失败 {recipient['email']} : {err}")
+    return "failed"
+
+@app.route("/delivery-report")
+def delivery_report():
+    # 吞吐与预计完成时间；配合 DELIVERY_BACKEND=simulated 做容量规划
+    with DISPATCHER.lock, SEND_LOCK:
+        pending = DISPATCHER.staged + DISPATCHER.backlog + DISPATCHER.inflight + len(RECIPIENTS)
+    return jsonify(DELIVERY_STATS.report(pending))
+
+# ================== 性能分析（管理接口） ==================
+@app.route("/admin/trace", methods=["GET", "POST"])
+def admin_trace():
+    # GET 查看追踪状态；POST {"enabled", "file"} 开关逐封追踪，file 只能是 TRACE_DIR 下的文件名
+    if request.method == "POST":
+        data = request.json or {}
+        if data.get("enabled"):
+            name = str(data.get("file") or "")
+            if name:
+                if os.path.basename(name) != name or name.startswith('.') or not name.endswith(".jsonl"):
+                    return jsonify({"message": "file 只能是 TRACE_DIR 下的 .jsonl 文件名"}), 400
+                os.makedirs(TRACE_DIR, exist_ok=True)
+                path = os.path.join(TRACE_DIR, name)
+            elif TRACE_FILE:
+                path = TRACE_FILE
+            else:
+                os.makedirs(TRACE_DIR, exist_ok=True)
+                path = os.path.join(TRACE_DIR, "trace.jsonl")
+            TRACER.start(path)
         else:
-            append_log(f"发送失败 {recipient['email']} : {err}")
-            with SEND_LOCK:
-                RECIPIENTS.append(recipient)
+            TRACER.stop()
+    return jsonify({"enabled": TRACER.enabled, "file": TRACER.path})
+
+PROFILE_LOCK = Lock()
+
+@app.route("/admin/profile")
+def admin_profile():
+    # 对发送线程采样 seconds 秒，返回 collapsed stacks（text/plain），可直接喂给 flamegraph.pl / speedscope
+    seconds = min(max(request.args.get("seconds", 10, type=float), 0.1), PROFILE_MAX_SECONDS)
+    interval = min(max(request.args.get("interval_ms", 5, type=float), 1), 1000) / 1000
+    if not PROFILE_LOCK.acquire(False):
+        return jsonify({"message": "已有采样在进行中"}), 409
+    try:
+        stacks = sample_stacks(seconds, interval, all_threads=request.args.get("threads") == "all")
+    finally:
+        PROFILE_LOCK.release()
+    return Response(stacks + "\n", mimetype="text/plain")
 
-        time.sleep(interval)
+@app.route("/admin/lock-stats")
+def admin_lock_stats():
+    return jsonify({lock.name: dict(lock.stats) for lock in (SEND_LOCK, DISPATCHER.lock, SAVE_LOCK)})
 
-    IS_SENDING = False
-    with SEND_LOCK:
-        if SEND_QUEUE:
-            SEND_QUEUE.pop(0)
+@app.route("/dispatch-status")
+def dispatch_status():
+    return jsonify(DISPATCHER.stats())
 
 @app.route("/pause-send", methods=["POST"])
 def pause_send():
@@ -679,16 +1858,38 @@ def resume_send():
 # ======= 历史日志 / 用量：用于刷新后回放 =======
 @app.route("/get-logs")
 def get_logs():
-    return jsonify({"logs": SEND_LOGS})
+    # since: 取该 id 之后的新日志；before: 取该 id 之前的更早日志；都不带则返回最新 limit 条
+    return jsonify(SEND_LOG.read(
+        since=request.args.get("since", type=int),
+        before=request.args.get("before", type=int),
+        limit=request.args.get("limit", 200, type=int)))
 
 @app.route("/get-usage")
 def get_usage():
-    return jsonify({"usage": account_usage})
+    return jsonify({"usage": QUOTA.usage(), "quota": QUOTA.snapshot(),
+                    "limit": QUOTA.limit, "mode": QUOTA.mode})
 
 # ================== 收件人管理 ==================
 @app.route("/recipients", methods=["GET"])
 def get_recipients():
-    return jsonify({"pending": RECIPIENTS, "sent": SENT_RECIPIENTS})
+    # 带 page 参数时服务端分页，只返回当前页；否则保持旧接口返回全部
+    if "page" in request.args:
+        page = max(1, request.args.get("page", 1, type=int))
+        per_page = min(max(1, request.args.get("per_page", 10, type=int)), 1000)
+        start = (page-1)*per_page
+        with DISPATCHER.lock, SEND_LOCK:
+            held = DISPATCHER.staged + DISPATCHER.backlog
+            staged = DISPATCHER.staged_records() if start < held else iter(())
+            items = RECIPIENTS.page(max(0, start-held), per_page - max(0, min(per_page, held-start)))
+            total = held + len(RECIPIENTS)
+            sent_total = len(SENT_RECIPIENTS)
+        items = list(itertools.islice(staged, start, start+per_page)) + items
+        return jsonify({"pending": items, "page": page, "per_page": per_page,
+                        "total": total, "sent_total": sent_total})
+    staged, pending = pending_snapshot()
+    with SEND_LOCK:
+        sent = list(SENT_RECIPIENTS)
+    return jsonify({"pending": list(staged) + list(pending), "sent": sent})
 
 @app.route("/upload-csv", methods=["POST"])
 def upload_csv():
@@ -697,33 +1898,114 @@ def upload_csv():
         return jsonify({"message":"未选择文件"}), 400
     csv_data = file.read().decode('utf-8').splitlines()
     reader = csv.DictReader(csv_data)
-    for row in reader:
-        if not row.get("email"):
-            continue
-        RECIPIENTS.append({
-            "email": row.get("email").strip(),
-            "name": row.get("name","").strip(),
-            "real_name": row.get("real_name","").strip()
-        })
+    added = duplicates = skipped = 0
+    with SEND_LOCK:
+        for row in reader:
+            if not row.get("email"):
+                continue
+            email = row.get("email").strip()
+            key = normalize_email(email)
+            if key in PENDING_INDEX:
+                duplicates += 1
+                continue
+            if skip_reason(key):
+                skipped += 1
+                continue
+            PENDING_INDEX.add(key)
+            RECIPIENTS.append({
+                "email": email,
+                "name": (row.get("name") or "").strip(),
+                "real_name": (row.get("real_name") or "").strip()
+            })
+            added += 1
     save_recipients()
-    append_log(f"已导入收件人 {len(RECIPIENTS)} 条（包含历史未发送）。")
-    return jsonify({"message":"CSV 上传成功"})
+    summary = f"新增 {added} 条，跳过重复 {duplicates} 条，跳过已发送/退订 {skipped} 条"
+    append_log(f"已导入收件人：{summary}，当前未发送共 {len(RECIPIENTS) + DISPATCHER.staged + DISPATCHER.backlog} 条。")
+    return jsonify({"message": f"CSV 上传成功：{summary}",
+                    "added": added, "duplicates": duplicates, "skipped": skipped})
+
+@app.route("/upload-suppression", methods=["POST"])
+def upload_suppression():
+    # 上传退订名单：带 email 列的 CSV，或每行一个地址
+    file = request.files.get('file')
+    if not file:
+        return jsonify({"message":"未选择文件"}), 400
+    lines = file.read().decode('utf-8').splitlines()
+    if lines and "email" in [h.strip().lower() for h in lines[0].split(',')]:
+        reader = csv.DictReader(lines, skipinitialspace=True)
+        reader.fieldnames = [(h or "").strip().lower() for h in reader.fieldnames]
+        emails = [(row.get("email") or "") for row in reader]
+    else:
+        emails = [line.split(',')[0] for line in lines]
+    added = add_suppressed(emails)
+    removed = _delete_recipients(lambda e: normalize_email(e) in SUPPRESSED)
+    if removed:
+        save_recipients()
+    append_log(f"已导入退订名单 {added} 个，移除未发送收件人 {removed} 条")
+    return jsonify({"message": f"退订名单已更新：新增 {added} 个，移除未发送收件人 {removed} 条",
+                    "added": added, "removed": removed})
+
+def email_matcher(data):
+    # 按 emails / domains / pattern（通配符）构造按规范化地址比较的匹配函数；三者都为空返回 None
+    def as_list(v):
+        if isinstance(v, str):
+            v = v.replace(',', '\n').splitlines()
+        return [x for x in (v or []) if str(x).strip()]
+    emails = {normalize_email(e) for e in as_list(data.get("emails"))}
+    domains = {d.strip().lower().lstrip('@') for d in as_list(data.get("domains"))}
+    pattern = (data.get("pattern") or "").strip().lower()
+    if not (emails or domains or pattern):
+        return None
+    def match(email):
+        key = normalize_email(email)
+        return key in emails or recipient_domain(key) in domains or bool(pattern and fnmatch.fnmatchcase(key, pattern))
+    return match
+
+def _delete_recipients(predicate):
+    # 一次加锁删除未发送收件人（含调度器中的）并计入任务 dropped，返回条数；不落盘
+    removed_keys, jobs = set(), Counter()
+    def hit(email):
+        if predicate(email):
+            removed_keys.add(normalize_email(email))
+            return True
+        return False
+    with DISPATCHER.lock, SEND_LOCK:
+        removed = RECIPIENTS.remove_if(hit, jobs) + DISPATCHER.remove_if(hit, jobs)
+        PENDING_INDEX.difference_update(removed_keys)
+    for job_id, n in jobs.items():
+        job_progress(job_id, "dropped", n)
+    return removed
 
 @app.route("/delete-recipient", methods=["POST"])
 def delete_recipient():
     data = request.json
     email = data.get("email")
-    global RECIPIENTS
-    RECIPIENTS = [r for r in RECIPIENTS if r["email"] != email]
+    _delete_recipients(lambda e: e == email)
     save_recipients()
     append_log(f"已删除收件人 {email}")
     return jsonify({"message": f"{email} 已删除"})
 
+@app.route("/bulk-delete-recipients", methods=["POST"])
+def bulk_delete_recipients():
+    # 批量删除：{"emails": [...], "domains": [...], "pattern": "*@x.com"}，一次扫描、一次落盘、一条日志
+    match = email_matcher(request.json or {})
+    if not match:
+        return jsonify({"message":"请提供 emails、domains 或 pattern"}), 400
+    removed = _delete_recipients(match)
+    if removed:
+        save_recipients()
+    append_log(f"批量删除未发送收件人 {removed} 条")
+    return jsonify({"message": f"已删除 {removed} 条", "removed": removed})
+
 @app.route("/clear-recipients", methods=["POST"])
 def clear_recipients():
-    global RECIPIENTS
-    count = len(RECIPIENTS)
-    RECIPIENTS = []
+    with DISPATCHER.lock, SEND_LOCK:
+        jobs = RECIPIENTS.job_counts()
+        count = len(RECIPIENTS) + DISPATCHER.remove_if(lambda e: True, jobs)
+        RECIPIENTS.clear()
+        PENDING_INDEX.clear()
+    for job_id, n in jobs.items():
+        job_progress(job_id, "dropped", n)
     save_recipients()
     append_log(f"已清空未发送收件人 {count} 条")
     return jsonify({"message":"收件人列表已清空"})
@@ -745,13 +2027,14 @@ def download_template():
 def download_recipients():
     status = request.args.get("status","pending")
     if status=="pending":
-        data = RECIPIENTS
+        data = itertools.chain(*pending_snapshot())
         filename="pending.csv"
     else:
-        data = SENT_RECIPIENTS
+        with SEND_LOCK:
+            data = SENT_RECIPIENTS.copy()
         filename="sent.csv"
     output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=["email","name","real_name"])
+    writer = csv.DictWriter(output, fieldnames=["email","name","real_name"], extrasaction="ignore")
     writer.writeheader()
     for r in data:
         writer.writerow(r)
@@ -763,6 +2046,190 @@ def download_recipients():
         as_attachment=True
     )
 
+# ================== 批量入队 API ==================
+JOBS = {}          # 任务 id -> 入队/发送计数
+IDEMPOTENCY = {}   # 幂等键 -> {"ts", "response"}，None 表示处理中
+JOBS_LOCK = Lock()
+
+def load_jobs():
+    for path, target in ((JOBS_FILE, JOBS), (IDEMPOTENCY_FILE, IDEMPOTENCY)):
+        target.clear()
+        if os.path.exists(path):
+            try:
+                with open(path,'r',encoding='utf-8') as f:
+                    target.update(json.load(f))
+            except Exception:
+                pass
+
+load_jobs()
+
+def _write_json(path, data):
+    # 调用方持有 SAVE_LOCK；临时文件名唯一，避免并发写互相覆盖/改名
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".")
+    with os.fdopen(fd,'w',encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def save_jobs():
+    # save_recipients 每次落盘都会调用，异常退出后与 recipients.json 一致
+    with SAVE_LOCK:
+        with JOBS_LOCK:
+            jobs = json.dumps(JOBS, ensure_ascii=False)
+        _write_json(JOBS_FILE, jobs)
+
+def save_idempotency():
+    cutoff = time.time() - IDEMPOTENCY_TTL_HOURS * 3600
+    with SAVE_LOCK:
+        with JOBS_LOCK:
+            for key in [k for k, v in IDEMPOTENCY.items() if v and v["ts"] < cutoff]:
+                del IDEMPOTENCY[key]
+            keys = json.dumps({k: v for k, v in IDEMPOTENCY.items() if v}, ensure_ascii=False)
+        _write_json(IDEMPOTENCY_FILE, keys)
+
+def job_progress(job_id, field, n=1):
+    if not job_id:
+        return
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if job:
+            job[field] = job.get(field, 0) + n
+            job["updated"] = time.time()
+
+def job_status(job):
+    pending = job["accepted"] - job.get("sent", 0) - job.get("dropped", 0)
+    return {**job, "pending": max(0, pending), "done": pending <= 0}
+
+def iter_json_array(stream, chunk_size=65536):
+    # 流式解析顶层 JSON 数组，逐个产出元素，不把整个请求体读进内存
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf, started = "", False
+    while True:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf += utf8.decode(chunk or b"", final=eof)
+        pos = 0
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("请求体必须是 JSON 数组")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof: raise
+                break
+            yield obj
+        buf = buf[pos:]
+        if eof:
+            raise ValueError("JSON 数组不完整")
+
+def iter_ndjson(stream):
+    # 逐行解析 NDJSON；坏行产出 None，由调用方计入 invalid
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+def _enqueue_chunk(items, job_id, counts):
+    with SEND_LOCK:
+        for item in items:
+            if not isinstance(item, dict) or "@" not in str(item.get("email") or ""):
+                counts["invalid"] += 1
+                continue
+            email = str(item["email"]).strip()
+            key = normalize_email(email)
+            if key in PENDING_INDEX:
+                counts["duplicates"] += 1
+                continue
+            if skip_reason(key):
+                counts["skipped"] += 1
+                continue
+            variables = item.get("vars")
+            PENDING_INDEX.add(key)
+            RECIPIENTS.append({
+                "email": email,
+                "name": str(item.get("name") or "").strip(),
+                "real_name": str(item.get("real_name") or "").strip(),
+                "vars": variables if isinstance(variables, dict) else None,
+                "job": job_id,
+            })
+            counts["accepted"] += 1
+
+@app.route("/api/enqueue", methods=["POST"])
+def api_enqueue():
+    # 批量入队：JSON 数组或 NDJSON 边读边解析；Idempotency-Key 重试返回首次结果，?job= 追加到同一任务
+    idem_key = request.headers.get("Idempotency-Key") or request.args.get("idempotency_key")
+    if idem_key:
+        with JOBS_LOCK:
+            if idem_key in IDEMPOTENCY:
+                done = IDEMPOTENCY[idem_key]
+                if done is None:
+                    return jsonify({"message": "相同 Idempotency-Key 的请求正在处理"}), 409
+                return jsonify({**done["response"], "replayed": True})
+            IDEMPOTENCY[idem_key] = None
+
+    job_id = request.args.get("job") or f"job-{uuid.uuid4().hex[:12]}"
+    with JOBS_LOCK:
+        job = JOBS.setdefault(job_id, {"id": job_id, "created": time.time(), "batches": 0, "accepted": 0,
+                                       "duplicates": 0, "skipped": 0, "invalid": 0, "sent": 0, "dropped": 0})
+    counts = {"accepted": 0, "duplicates": 0, "skipped": 0, "invalid": 0}
+    ndjson = "ndjson" in (request.content_type or "") or "jsonl" in (request.content_type or "")
+    items = iter_ndjson(request.stream) if ndjson else iter_json_array(request.stream)
+    error = None
+    try:
+        while True:
+            chunk = list(itertools.islice(items, ENQUEUE_CHUNK))
+            if not chunk:
+                break
+            _enqueue_chunk(chunk, job_id, counts)
+    except Exception as e:
+        error = str(e)
+
+    with JOBS_LOCK:
+        for k, v in counts.items():
+            job[k] += v
+        job["batches"] += 1
+        job["updated"] = time.time()
+    response = {"job": job_id, **counts, "status_url": f"/api/jobs/{job_id}"}
+    if counts["accepted"]:
+        save_recipients()
+    with JOBS_LOCK:
+        if idem_key:
+            # 解析出错时不记录幂等结果，允许带同一个键重试（逐条去重保证不会重复入队）
+            if error: IDEMPOTENCY.pop(idem_key, None)
+            else: IDEMPOTENCY[idem_key] = {"ts": time.time(), "response": response}
+    if not counts["accepted"]:
+        save_jobs()
+    save_idempotency()
+    append_log(f"API 入队 {job_id}：接收 {counts['accepted']} 条，重复 {counts['duplicates']} 条，"
+               f"跳过已发送/退订 {counts['skipped']} 条，无效 {counts['invalid']} 条")
+    if error:
+        return jsonify({**response, "message": f"请求体解析失败：{error}"}), 400
+    return jsonify(response)
+
+@app.route("/api/jobs/<job_id>")
+def api_job_status(job_id):
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if not job:
+            return jsonify({"message": "任务不存在"}), 404
+        return jsonify(job_status(job))
+
 # ================== 账号管理 ==================
 @app.route("/accounts")
 def get_accounts():
@@ -811,9 +2278,8 @@ def upload_accounts():
             ACCOUNTS[existing_idx] = rec
         else:
             ACCOUNTS.append(rec)
-        account_usage.setdefault(email, 0)
+        QUOTA.ensure(email)
         added += 1
-    save_usage()
     append_log(f"已导入/更新账号 {added} 个")
     return jsonify({"message":"账号上传成功"})
 
@@ -823,11 +2289,50 @@ def delete_account():
     email = data.get("email")
     global ACCOUNTS
     ACCOUNTS = [acc for acc in ACCOUNTS if acc["email"] != email]
-    account_usage.pop(email, None)
-    save_usage()
+    QUOTA.forget(email)
     append_log(f"已删除账号 {email}")
     return jsonify({"message": f"{email} 已删除"})
 
+def _bulk_account_matcher(data):
+    if data.get("all"):
+        return lambda e: True
+    return email_matcher(data)
+
+@app.route("/bulk-toggle-accounts", methods=["POST"])
+def bulk_toggle_accounts():
+    # 批量启用/禁用：{"emails"|"domains"|"pattern"|"all": true, "checked": true/false}
+    data = request.json or {}
+    match = _bulk_account_matcher(data)
+    if not match:
+        return jsonify({"message":"请提供 emails、domains、pattern 或 all"}), 400
+    checked = bool(data.get("checked"))
+    changed = 0
+    with SEND_LOCK:
+        for acc in ACCOUNTS:
+            if match(acc["email"]):
+                acc["selected"] = checked
+                changed += 1
+    append_log(f"批量{ '启用' if checked else '禁用' }账号 {changed} 个")
+    return jsonify({"message": f"已{ '启用' if checked else '禁用' } {changed} 个账号", "changed": changed})
+
+@app.route("/bulk-delete-accounts", methods=["POST"])
+def bulk_delete_accounts():
+    # 批量删除账号：{"emails"|"domains"|"pattern"|"all": true}，用量一次落盘
+    global ACCOUNTS
+    match = _bulk_account_matcher(request.json or {})
+    if not match:
+        return jsonify({"message":"请提供 emails、domains、pattern 或 all"}), 400
+    kept, removed = [], []
+    with SEND_LOCK:
+        for acc in ACCOUNTS:
+            if match(acc["email"]): removed.append(acc["email"])
+            else: kept.append(acc)
+        ACCOUNTS = kept
+    if removed:
+        QUOTA.forget(*removed)
+    append_log(f"批量删除账号 {len(removed)} 个")
+    return jsonify({"message": f"已删除 {len(removed)} 个账号", "removed": len(removed)})
+
 # ================== Keep Alive ==================
 @app.route("/ping")
 def ping():
@@ -847,9 +2352,6 @@ def keep_alive():
 
 # ================== 启动 ==================
 if __name__ == "__main__":
-    for acc in ACCOUNTS:
-        account_usage.setdefault(acc["email"], 0)
-    save_usage()
     port = int(os.environ.get("PORT", 10000))
 
     keep_alive()   # <-- 在这里启动自 ping 线程
@@ -0,0 +1,166 @@
+# 收件人紧凑存储，不依赖 main 的全局状态，基准脚本可单独导入
+import json
+from array import array
+from collections import Counter
+
+
+class RecipientStore:
+    # 收件人紧凑存储：email/name/real_name/vars 以 \0 拼成一行按偏移存进 bytearray，job 驻留为整数 id；调用方持有 SEND_LOCK
+    TEXT_FIELDS = ("email", "name", "real_name", "vars")
+    INTERNED_FIELDS = ("job",)
+    OPTIONAL_FIELDS = ("vars", "job")   # 为空时不出现在记录 dict 中；vars 以 JSON 字符串保存
+    SEP = b"\0"
+    COMPACT_MIN = 4096  # 头部已弹出的记录超过该值且过半时压缩缓冲区
+
+    __slots__ = ("_buf", "_offsets", "_base", "_cols", "_head", "_strings", "_string_ids")
+
+    def __init__(self, records=()):
+        self.clear()
+        self.extend(records)
+
+    def _empty(self):
+        return bytearray(), array('Q', [0]), {f: array('I') for f in self.INTERNED_FIELDS}
+
+    def clear(self):
+        self._buf, self._offsets, self._cols = self._empty()
+        self._base = self._head = 0
+        self._strings = [""]
+        self._string_ids = {"": 0}
+
+    def _intern(self, value):
+        sid = self._string_ids.get(value)
+        if sid is None:
+            sid = len(self._strings)
+            self._strings.append(value)
+            self._string_ids[value] = sid
+        return sid
+
+    @staticmethod
+    def _encode(field, value):
+        if field == "vars" and value and not isinstance(value, str):
+            return json.dumps(value, ensure_ascii=False, sort_keys=True)
+        return value or ""
+
+    def _pack(self, rec):
+        return self.SEP.join(self._encode(f, rec.get(f)).replace("\0", "").encode('utf-8')
+                             for f in self.TEXT_FIELDS)
+
+    def _row(self, i):
+        return self._buf[self._offsets[i]-self._base:self._offsets[i+1]-self._base]
+
+    def _email_at(self, i):
+        row = self._row(i)
+        return row[:row.find(self.SEP)].decode('utf-8')
+
+    def _record_at(self, i):
+        rec = {f: raw.decode('utf-8') for f, raw in zip(self.TEXT_FIELDS, self._row(i).split(self.SEP))}
+        for f in self.INTERNED_FIELDS:
+            rec[f] = self._strings[self._cols[f][i]]
+        for f in self.OPTIONAL_FIELDS:
+            if not rec[f]:
+                del rec[f]
+            elif f == "vars":
+                rec[f] = json.loads(rec[f])
+        return rec
+
+    def __len__(self):
+        return len(self._offsets) - 1 - self._head
+
+    def __iter__(self):
+        for i in range(self._head, len(self._offsets) - 1):
+            yield self._record_at(i)
+
+    def append(self, rec):
+        self._buf += self._pack(rec)
+        self._offsets.append(self._base + len(self._buf))
+        for f in self.INTERNED_FIELDS:
+            self._cols[f].append(self._intern(self._encode(f, rec.get(f))))
+
+    def extend(self, records):
+        for rec in records:
+            self.append(rec)
+
+    def popleft(self):
+        if not len(self):
+            raise IndexError("pop from empty RecipientStore")
+        if self._head >= self.COMPACT_MIN and self._head * 2 >= len(self._offsets):
+            self._compact()
+        rec = self._record_at(self._head)
+        self._head += 1
+        return rec
+
+    def extendleft(self, records):
+        # 把一批记录按原顺序放回队首：新记录占用队首之前的逻辑位置，原有偏移不动
+        buf, offsets, cols = self._empty()
+        for rec in records:
+            buf += self._pack(rec)
+            offsets.append(len(buf))
+            for f in self.INTERNED_FIELDS:
+                cols[f].append(self._intern(self._encode(f, rec.get(f))))
+        if len(offsets) == 1:
+            return
+        start = self._offsets[self._head]
+        base = start - len(buf)
+        if base >= 0:
+            offsets = array('Q', (o + base for o in offsets))
+            offsets.extend(self._offsets[self._head+1:])
+        else:
+            # 队首之前的逻辑位置不够（从未弹出过时才会出现），整体平移一次
+            base, shift = 0, len(buf) - start
+            offsets.extend(o + shift for o in self._offsets[self._head+1:])
+        buf += self._buf[start-self._base:]
+        for f in self.INTERNED_FIELDS:
+            cols[f].extend(self._cols[f][self._head:])
+        self._buf, self._offsets, self._cols, self._base, self._head = buf, offsets, cols, base, 0
+
+    def remove_if(self, predicate, jobs=None):
+        # 删除 email 满足 predicate 的记录，单次重建，返回删除条数；jobs（Counter）按任务累计删除条数
+        buf, offsets, cols = self._empty()
+        removed = 0
+        for i in range(self._head, len(self._offsets) - 1):
+            row = self._row(i)
+            if predicate(row[:row.find(self.SEP)].decode('utf-8')):
+                removed += 1
+                if jobs is not None and self._cols["job"][i]:
+                    jobs[self._strings[self._cols["job"][i]]] += 1
+                continue
+            buf += row
+            offsets.append(len(buf))
+            for f in self.INTERNED_FIELDS:
+                cols[f].append(self._cols[f][i])
+        if removed:
+            self._buf, self._offsets, self._cols, self._base, self._head = buf, offsets, cols, 0, 0
+        return removed
+
+    def job_counts(self):
+        # 按任务统计当前记录条数（不含无任务的记录）
+        counts = Counter(self._cols["job"][self._head:])
+        counts.pop(0, None)
+        return Counter({self._strings[sid]: n for sid, n in counts.items()})
+
+    def page(self, start, count):
+        start = max(0, start)
+        lo = self._head + start
+        hi = min(lo + max(0, count), len(self._offsets) - 1)
+        return [self._record_at(i) for i in range(lo, hi)]
+
+    def copy(self):
+        # 只读快照（用于持久化/导出）：只做 C 层切片，偏移不改写；驻留表只追加不修改，直接共享
+        other = RecipientStore.__new__(RecipientStore)
+        start = self._offsets[self._head]
+        other._buf = self._buf[start-self._base:]
+        other._offsets = self._offsets[self._head:]
+        other._base = start
+        other._cols = {f: self._cols[f][self._head:] for f in self.INTERNED_FIELDS}
+        other._head = 0
+        other._strings = self._strings
+        other._string_ids = self._string_ids
+        return other
+
+    def _compact(self):
+        start = self._offsets[self._head]
+        del self._buf[:start-self._base]
+        del self._offsets[:self._head]
+        for f in self.INTERNED_FIELDS:
+            del self._cols[f][:self._head]
+        self._base, self._head = start, 0